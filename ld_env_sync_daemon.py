@@ -11,10 +11,12 @@ Configuration (via environment variables):
                                       default: SAMPLE_API_URL,SAMPLE_SERVICE_URL,SAMPLE_APP_URL
   - ENV_FILE_PATH        (optional) Path to .env file (default: ./.env)
   - BACKUP_ENABLED       (optional) true/false to enable timestamped backups (default: true)
+  - BACKUP_RETAIN        (optional) Number of most recent backups to keep; 0 keeps all (default: 10)
   - LOG_LEVEL            (optional) DEBUG | INFO | WARNING | ERROR | CRITICAL (default: INFO)
   - DEBOUNCE_MS          (optional) Milliseconds to debounce rapid updates (default: 400)
   - LD_CONTEXT_KEY       (optional) Context key used for evaluation (default: sample-daemon)
   - LD_CONTEXT_NAME      (optional) Human-readable name for context (default: Daemon)
+  - LD_SEND_EVENTS       (optional) true/false to send analytics events to LaunchDarkly (default: false)
 
 Run:
   python ld_env_sync_daemon.py
@@ -24,6 +26,8 @@ Requires packages:
   python-dotenv
 """
 
+import errno
+import glob
 import json
 import logging
 import os
@@ -33,51 +37,74 @@ import sys
 import threading
 import time
 from dataclasses import dataclass
-from datetime import datetime
-from typing import Dict, List
+from typing import Dict, List, Mapping, Tuple
 
 import ldclient
 from ldclient.config import Config
 from ldclient.context import Context
-from dotenv import set_key
+from dotenv import dotenv_values
+from dotenv.parser import parse_stream
 
 
 @dataclass
 class DaemonConfig:
     sdk_key: str
-    flag_keys: List[str]
+    flag_keys: Tuple[str, ...]
     env_file_path: str
     backup_enabled: bool
+    backup_retain: int
     log_level: str
     debounce_ms: int
     context_key: str
     context_name: str
+    send_events: bool
 
 
-def load_config_from_env() -> DaemonConfig:
-    sdk_key = os.getenv("LD_SDK_KEY", "").strip()
-    default_flags = [
-        "SAMPLE_API_URL",
-        "SAMPLE_SERVICE_URL",
-        "SAMPLE_APP_URL",
-    ]
-    flags_env = os.getenv("FLAGS", ",".join(default_flags))
-    flag_keys = [k.strip() for k in flags_env.split(",") if k.strip()]
-    env_file_path = os.getenv("ENV_FILE_PATH", ".env")
-    backup_enabled = os.getenv("BACKUP_ENABLED", "true").lower() in {"1", "true", "yes", "y"}
-    log_level = os.getenv("LOG_LEVEL", "INFO").upper()
-    debounce_ms = int(os.getenv("DEBOUNCE_MS", "400"))
-    context_key = os.getenv("LD_CONTEXT_KEY", "sample-daemon")
-    context_name = os.getenv("LD_CONTEXT_NAME", "Daemon")
+DEFAULT_FLAG_KEYS = (
+    "SAMPLE_API_URL",
+    "SAMPLE_SERVICE_URL",
+    "SAMPLE_APP_URL",
+)
+_TRUTHY = frozenset({"1", "true", "yes", "y"})
+
+
+def _parse_non_negative_int(env: Mapping[str, str], name: str, default: str) -> int:
+    raw = env.get(name, default)
+    try:
+        value = int(raw)
+    except ValueError:
+        value = -1
+    if value < 0:
+        logging.critical("%s must be a non-negative integer, got %r.", name, raw)
+        sys.exit(2)
+    return value
+
+
+def load_config_from_env(env: Mapping[str, str] | None = None) -> DaemonConfig:
+    # Single snapshot of the environment; also lets callers inject a plain dict
+    env = dict(os.environ if env is None else env)
+    sdk_key = env.get("LD_SDK_KEY", "").strip()
+    flags_env = env.get("FLAGS", ",".join(DEFAULT_FLAG_KEYS))
+    flag_keys = tuple(k.strip() for k in flags_env.split(",") if k.strip())
+    env_file_path = env.get("ENV_FILE_PATH", ".env")
+    backup_enabled = env.get("BACKUP_ENABLED", "true").lower() in _TRUTHY
+    backup_retain = _parse_non_negative_int(env, "BACKUP_RETAIN", "10")
+    log_level = env.get("LOG_LEVEL", "INFO").upper()
+    debounce_ms = _parse_non_negative_int(env, "DEBOUNCE_MS", "400")
+    context_key = env.get("LD_CONTEXT_KEY", "sample-daemon")
+    context_name = env.get("LD_CONTEXT_NAME", "Daemon")
+    send_events = env.get("LD_SEND_EVENTS", "false").lower() in _TRUTHY
     return DaemonConfig(
         sdk_key=sdk_key,
         flag_keys=flag_keys,
         env_file_path=env_file_path,
         backup_enabled=backup_enabled,
+        backup_retain=backup_retain,
         log_level=log_level,
         debounce_ms=debounce_ms,
         context_key=context_key,
         context_name=context_name,
+        send_events=send_events,
     )
 
 
@@ -91,21 +118,42 @@ def configure_logging(level_name: str) -> None:
 
 
 class Debouncer:
-    """Simple thread-safe debouncer to coalesce rapid events."""
+    """Simple thread-safe debouncer to coalesce rapid events.
+
+    A single long-lived worker thread sleeps until the current deadline;
+    each trigger() just pushes the deadline out and wakes the worker.
+    """
 
     def __init__(self, debounce_ms: int, action):
-        self._debounce_seconds = max(0, debounce_ms) / 1000.0
+        self._debounce_ns = debounce_ms * 1_000_000
         self._action = action
         self._lock = threading.Lock()
-        self._timer: threading.Timer | None = None
+        self._wake = threading.Event()
+        self._deadline_ns: int | None = None
+        self._stopping = False
+        self._worker = threading.Thread(target=self._loop, name="debouncer", daemon=True)
+        self._worker.start()
 
     def trigger(self) -> None:
         with self._lock:
-            if self._timer is not None:
-                self._timer.cancel()
-            self._timer = threading.Timer(self._debounce_seconds, self._run)
-            self._timer.daemon = True
-            self._timer.start()
+            self._deadline_ns = time.monotonic_ns() + self._debounce_ns
+        self._wake.set()
+
+    def _loop(self) -> None:
+        while True:
+            with self._lock:
+                deadline_ns = self._deadline_ns
+            # Integer math per trigger; convert to float seconds only when actually sleeping
+            timeout = None if deadline_ns is None else max(0, deadline_ns - time.monotonic_ns()) / 1e9
+            self._wake.wait(timeout)
+            self._wake.clear()
+            with self._lock:
+                if self._stopping:
+                    return
+                if self._deadline_ns is None or time.monotonic_ns() < self._deadline_ns:
+                    continue
+                self._deadline_ns = None
+            self._run()
 
     def _run(self) -> None:
         try:
@@ -115,35 +163,104 @@ class Debouncer:
 
     def cancel(self) -> None:
         with self._lock:
-            if self._timer is not None:
-                self._timer.cancel()
-                self._timer = None
+            self._deadline_ns = None
+            self._stopping = True
+        self._wake.set()
+        if self._worker is not threading.current_thread():
+            self._worker.join(timeout=1.0)
+
+
+def prune_backups(path: str, retain: int) -> None:
+    if retain <= 0:
+        return
+    # Match only the exact YYYYMMDD-HHMMSS shape written by backup_env_file. Order by
+    # mtime rather than name: local timestamps repeat or go backwards across DST/NTP steps
+    backups = []
+    for backup in glob.glob(f"{glob.escape(path)}.{'[0-9]' * 8}-{'[0-9]' * 6}"):
+        try:
+            backups.append((os.stat(backup).st_mtime_ns, backup))
+        except FileNotFoundError:
+            continue
+    backups.sort()
+    for _mtime, stale in backups[:-retain]:
+        try:
+            os.unlink(stale)
+            logging.debug("Removed old backup %s", stale)
+        except OSError as exc:
+            logging.warning("Could not remove old backup %s: %s", stale, exc)
 
 
-def ensure_file_permissions_owner_rw(path: str) -> None:
-    try:
-        os.chmod(path, 0o600)
-    except Exception:
-        logging.debug("Could not set file permissions to 600 for %s", path)
+# Errors meaning "hardlinks are not possible here" rather than a real failure
+_LINK_FALLBACK_ERRNOS = frozenset({errno.EXDEV, errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EMLINK})
 
 
-def backup_env_file(path: str) -> str | None:
+def backup_env_file(path: str, retain: int = 0) -> str | None:
     if not os.path.exists(path):
         return None
-    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
     backup_path = f"{path}.{timestamp}"
-    shutil.copy2(path, backup_path)
+    # The writer installs new content via os.replace, so a hardlink to the current
+    # inode is a stable snapshot; fall back to a full copy where linking is unsupported
+    try:
+        os.link(path, backup_path)
+    except FileExistsError:
+        # A backup was already taken this second (e.g. a retried write); keep it
+        logging.debug("Backup %s already exists; skipping", backup_path)
+        return backup_path
+    except OSError as exc:
+        if exc.errno not in _LINK_FALLBACK_ERRNOS:
+            raise
+        shutil.copy2(path, backup_path)
     logging.info("Backed up %s to %s", path, backup_path)
+    prune_backups(path, retain)
     return backup_path
 
 
-def write_env_values(path: str, values: Dict[str, str], backup_enabled: bool) -> None:
+def write_env_values(path: str, values: Dict[str, str], backup_enabled: bool, backup_retain: int = 0) -> None:
     if backup_enabled and os.path.exists(path):
-        backup_env_file(path)
-    # Write values using python-dotenv set_key to update or add keys
+        backup_env_file(path, backup_retain)
+    # Merge values into the parsed entries in memory; python-dotenv's parser keeps
+    # multi-line quoted values intact, and every other entry is written back verbatim
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            bindings = list(parse_stream(fh))
+    except FileNotFoundError:
+        bindings = []
+    chunks: List[str] = []
+    replaced = set()
+    for binding in bindings:
+        if binding.key is not None and binding.key in values:
+            chunks.append(f"{binding.key}={values[binding.key]}\n")
+            replaced.add(binding.key)
+        else:
+            chunks.append(binding.original.string)
+    if chunks and not chunks[-1].endswith("\n"):
+        chunks.append("\n")
     for key, value in values.items():
-        set_key(path, key, str(value), quote_mode="never")
-    ensure_file_permissions_owner_rw(path)
+        if key not in replaced:
+            chunks.append(f"{key}={value}\n")
+    buf = "".join(chunks).encode("utf-8")
+
+    # Single write to a temp file, then atomically swap it into place
+    tmp_path = f"{path}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        try:
+            # O_CREAT's mode is ignored for a stale temp file, so enforce 0600 explicitly
+            os.fchmod(fd, 0o600)
+            view = memoryview(buf)
+            while view:
+                view = view[os.write(fd, view):]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
     logging.info("Updated %s with %d key(s)", path, len(values))
 
 
@@ -159,26 +276,47 @@ class EnvSyncDaemon:
         self._stop_event = threading.Event()
         self._client = None  # type: ignore[assignment]
         self._context: Context | None = None
-        self._debouncer = Debouncer(config.debounce_ms, self._sync_all_flags_to_env)
+        self._last_values: Dict[str, str] = {}
+        # Logging is configured before the daemon is built; cache the level check for hot callbacks
+        self._debug_enabled = logging.getLogger().isEnabledFor(logging.DEBUG)
+        self._dirty: set[str] = set()
+        self._dirty_lock = threading.Lock()
+        self._debouncer: Debouncer | None = None
 
     def start(self) -> None:
         if not self._config.sdk_key:
             logging.critical("LD_SDK_KEY is required. Set it in the environment and retry.")
             sys.exit(2)
+        if not self._config.flag_keys:
+            logging.critical("FLAGS is empty. Set at least one flag key and retry.")
+            sys.exit(2)
+
+        # Only start the debounce worker once there is something to sync
+        self._debouncer = Debouncer(self._config.debounce_ms, self._sync_changed_flags_to_env)
 
         logging.info("Starting LaunchDarkly client and initializing streaming connection…")
         ldclient.set_config(
             Config(
                 sdk_key=self._config.sdk_key,
                 stream=True,
-                send_events=True,
+                send_events=self._config.send_events,
             )
         )
         self._client = ldclient.get()
+        # Built once and passed by reference to every evaluation
         self._context = build_context(self._config.context_key, self._config.context_name)
 
+        # Install handlers before waiting so Ctrl+C/SIGTERM can abort startup cleanly
+        self._install_signal_handlers()
+
         # Wait a short period for initial data; proceed even if not ready to avoid deadlock
         self._wait_for_initialization(max_wait_seconds=10)
+        if self._stop_event.is_set():
+            self._shutdown()
+            return
+
+        # Prime the cache from the existing .env so an already in-sync file is left untouched
+        self._prime_last_values()
 
         # Initial sync
         logging.info("Performing initial flag evaluation and .env sync…")
@@ -190,19 +328,29 @@ class EnvSyncDaemon:
         # Keep running until stopped
         self._run_loop()
 
+    def _prime_last_values(self) -> None:
+        # Same parser as the writer, so quoted values compare unquoted
+        existing = dotenv_values(self._config.env_file_path, interpolate=False)
+        self._last_values = {
+            k: existing[k] for k in self._config.flag_keys if existing.get(k) is not None
+        }
+
     def _wait_for_initialization(self, max_wait_seconds: int) -> None:
         if self._client is None:
             return
+        is_initialized = self._client.is_initialized
         waited = 0
-        while waited < max_wait_seconds:
-            try:
-                if self._client.is_initialized():
+        try:
+            while waited < max_wait_seconds:
+                if is_initialized():
                     logging.info("LaunchDarkly client initialized.")
                     return
-            except Exception:
-                pass
-            time.sleep(0.5)
-            waited += 0.5
+                if self._stop_event.wait(0.5):
+                    return
+                waited += 0.5
+        except Exception as exc:  # noqa: BLE001
+            logging.debug("Could not check LaunchDarkly client initialization: %s", exc)
+            return
         logging.warning("LaunchDarkly client did not report initialized after %ss; continuing.", max_wait_seconds)
 
     def _register_flag_listeners(self) -> None:
@@ -215,26 +363,45 @@ class EnvSyncDaemon:
             logging.warning("Flag tracker not available; will rely on periodic syncs. %s", exc)
             return
 
-        def on_value_change(_event) -> None:
-            logging.debug("Flag value change event received; scheduling debounced sync…")
-            self._debouncer.trigger()
+        def make_listener(flag_key: str):
+            # Bind the key per listener so the callback never has to inspect the event
+            def on_value_change(_event) -> None:
+                if self._debug_enabled:
+                    logging.debug("Flag value change event received; scheduling debounced sync…")
+                self._dirty_add(flag_key)
+                self._debouncer.trigger()
+
+            return on_value_change
 
         for flag_key in self._config.flag_keys:
             try:
-                flag_tracker.add_flag_value_change_listener(flag_key, self._context, on_value_change)
+                flag_tracker.add_flag_value_change_listener(flag_key, self._context, make_listener(flag_key))
                 logging.info("Registered change listener for flag '%s'", flag_key)
             except Exception as exc:  # noqa: BLE001
                 logging.error("Failed to register listener for flag '%s': %s", flag_key, exc)
 
+    def _dirty_add(self, flag_key: str) -> None:
+        with self._dirty_lock:
+            self._dirty.add(flag_key)
+
     def _evaluate_all_flags(self) -> Dict[str, str]:
+        return self._evaluate_flags(self._config.flag_keys)
+
+    def _evaluate_flags(self, flag_keys: Tuple[str, ...]) -> Dict[str, str]:
         if self._client is None or self._context is None:
             return {}
+        variation = self._client.variation
+        ctx = self._context
+        # Default value as empty string if flag missing/mismatched type
+        try:
+            return {flag_key: str(variation(flag_key, ctx, "")) for flag_key in flag_keys}
+        except Exception:  # noqa: BLE001
+            pass
+        # Slow path: isolate the failing flag(s) so the rest still get written
         values: Dict[str, str] = {}
-        for flag_key in self._config.flag_keys:
+        for flag_key in flag_keys:
             try:
-                # Default value as empty string if flag missing/mismatched type
-                val = self._client.variation(flag_key, self._context, "")
-                values[flag_key] = str(val)
+                values[flag_key] = str(variation(flag_key, ctx, ""))
             except Exception as exc:  # noqa: BLE001
                 logging.warning("Failed to evaluate flag '%s': %s", flag_key, exc)
                 values[flag_key] = ""
@@ -245,11 +412,39 @@ class EnvSyncDaemon:
         if not values:
             logging.warning("No flag values evaluated; skipping .env write.")
             return
-        write_env_values(self._config.env_file_path, values, self._config.backup_enabled)
+        self._write_if_changed(values)
 
-    def _run_loop(self) -> None:
-        logging.info("Daemon is running. Press Ctrl+C to stop.")
+    def _sync_changed_flags_to_env(self) -> None:
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return
+        try:
+            changed = self._evaluate_flags(tuple(dirty))
+            if not changed:
+                logging.warning("No flag values evaluated; skipping .env write.")
+                return
+            self._write_if_changed({**self._last_values, **changed})
+        except Exception:
+            # Keep the keys pending so the next sync retries them instead of
+            # merging over stale values in _last_values
+            with self._dirty_lock:
+                self._dirty |= dirty
+            raise
+
+    def _write_if_changed(self, values: Dict[str, str]) -> None:
+        if values == self._last_values:
+            logging.debug("No flag value changes; skipping .env write.")
+            return
+        write_env_values(
+            self._config.env_file_path,
+            values,
+            self._config.backup_enabled,
+            self._config.backup_retain,
+        )
+        self._last_values = values
 
+    def _install_signal_handlers(self) -> None:
         def handle_signal(signum, _frame):
             logging.info("Received signal %s; shutting down…", signum)
             self.stop()
@@ -257,9 +452,11 @@ class EnvSyncDaemon:
         signal.signal(signal.SIGINT, handle_signal)
         signal.signal(signal.SIGTERM, handle_signal)
 
+    def _run_loop(self) -> None:
+        logging.info("Daemon is running. Press Ctrl+C to stop.")
         try:
-            while not self._stop_event.is_set():
-                time.sleep(1.0)
+            # Block until stop() is called from a signal handler; no periodic wake-ups
+            self._stop_event.wait()
         finally:
             self._shutdown()
 
@@ -268,10 +465,11 @@ class EnvSyncDaemon:
 
     def _shutdown(self) -> None:
         logging.info("Stopping daemon…")
-        try:
-            self._debouncer.cancel()
-        except Exception:
-            pass
+        if self._debouncer is not None:
+            try:
+                self._debouncer.cancel()
+            except Exception:
+                pass
         if self._client is not None:
             try:
                 self._client.close()
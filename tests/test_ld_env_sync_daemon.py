@@ -0,0 +1,208 @@
+import errno
+import os
+import threading
+import time
+
+import pytest
+
+import ld_env_sync_daemon as daemon
+
+
+def test_write_env_values_keeps_multiline_values_intact(tmp_path):
+    env_file = tmp_path / ".env"
+    env_file.write_text('# managed\nMULTI="line1\nC=inner\n"\nA=1\n', encoding="utf-8")
+
+    daemon.write_env_values(str(env_file), {"A": "2", "C": "3"}, backup_enabled=False)
+
+    assert env_file.read_text(encoding="utf-8") == '# managed\nMULTI="line1\nC=inner\n"\nA=2\nC=3\n'
+
+
+def test_write_env_values_updates_every_duplicate_key(tmp_path):
+    env_file = tmp_path / ".env"
+    env_file.write_text("A=1\nB=x\nA=1", encoding="utf-8")
+
+    daemon.write_env_values(str(env_file), {"A": "2"}, backup_enabled=False)
+
+    assert env_file.read_text(encoding="utf-8") == "A=2\nB=x\nA=2\n"
+    assert not (tmp_path / ".env.tmp").exists()
+
+
+class FakeClient:
+    def __init__(self, values):
+        self.values = values
+        self.calls = []
+
+    def variation(self, flag_key, _context, default):
+        self.calls.append(flag_key)
+        return self.values.get(flag_key, default)
+
+
+def make_daemon(tmp_path, values, flags="A,B"):
+    config = daemon.load_config_from_env(
+        {"FLAGS": flags, "ENV_FILE_PATH": str(tmp_path / ".env"), "BACKUP_ENABLED": "false"}
+    )
+    env_sync = daemon.EnvSyncDaemon(config)
+    env_sync._client = FakeClient(values)
+    env_sync._context = "ctx"
+    return env_sync
+
+
+def test_initial_sync_skips_write_when_quoted_file_is_in_sync(tmp_path):
+    env_file = tmp_path / ".env"
+    env_file.write_text('A="x"\nB=\'y\'\n', encoding="utf-8")
+    before = env_file.stat().st_mtime_ns
+    env_sync = make_daemon(tmp_path, {"A": "x", "B": "y"})
+
+    env_sync._prime_last_values()
+    env_sync._sync_all_flags_to_env()
+
+    assert env_sync._last_values == {"A": "x", "B": "y"}
+    assert env_file.stat().st_mtime_ns == before
+    assert env_file.read_text(encoding="utf-8") == 'A="x"\nB=\'y\'\n'
+
+
+def test_backup_env_file_keeps_existing_same_second_backup(tmp_path, monkeypatch):
+    env_file = tmp_path / ".env"
+    env_file.write_text("A=1\n", encoding="utf-8")
+    monkeypatch.setattr(daemon.time, "strftime", lambda _fmt: "20260101-120000")
+
+    first = daemon.backup_env_file(str(env_file))
+    # Retry within the same second while the backup still links the live inode
+    second = daemon.backup_env_file(str(env_file))
+
+    assert first == second == f"{env_file}.20260101-120000"
+    assert (tmp_path / ".env.20260101-120000").read_text(encoding="utf-8") == "A=1\n"
+
+
+def test_backup_env_file_copies_when_hardlinks_are_unsupported(tmp_path, monkeypatch):
+    env_file = tmp_path / ".env"
+    env_file.write_text("A=1\n", encoding="utf-8")
+
+    def no_link(_src, _dst):
+        raise OSError(errno.EXDEV, "cross-device link")
+
+    monkeypatch.setattr(daemon.os, "link", no_link)
+
+    backup = daemon.backup_env_file(str(env_file))
+
+    assert backup is not None
+    assert os.stat(backup).st_ino != env_file.stat().st_ino
+    assert open(backup, encoding="utf-8").read() == "A=1\n"
+
+
+def test_backup_env_file_raises_unexpected_link_errors(tmp_path, monkeypatch):
+    env_file = tmp_path / ".env"
+    env_file.write_text("A=1\n", encoding="utf-8")
+
+    def denied(_src, _dst):
+        raise OSError(errno.EACCES, "permission denied")
+
+    monkeypatch.setattr(daemon.os, "link", denied)
+
+    with pytest.raises(OSError):
+        daemon.backup_env_file(str(env_file))
+
+
+def test_prune_backups_keeps_newest_by_mtime(tmp_path):
+    env_file = tmp_path / ".env"
+    env_file.write_text("A=1\n", encoding="utf-8")
+    # After a DST fall-back the newest backup has the smallest name
+    ages = {"20261025-023000": 3, "20261025-020000": 2, "20261025-021500": 1}
+    for stamp, mtime in ages.items():
+        backup = tmp_path / f".env.{stamp}"
+        backup.write_text("A=0\n", encoding="utf-8")
+        os.utime(backup, ns=(mtime * 10**9, mtime * 10**9))
+    unrelated = tmp_path / ".env.2024-01-01.bak-1"
+    unrelated.write_text("keep\n", encoding="utf-8")
+
+    daemon.prune_backups(str(env_file), retain=2)
+
+    remaining = sorted(p.name for p in tmp_path.iterdir())
+    assert remaining == [".env", ".env.2024-01-01.bak-1", ".env.20261025-020000", ".env.20261025-023000"]
+
+
+@pytest.mark.parametrize("name", ["DEBOUNCE_MS", "BACKUP_RETAIN"])
+@pytest.mark.parametrize("raw", ["soon", "-1", ""])
+def test_load_config_rejects_invalid_integers(name, raw):
+    with pytest.raises(SystemExit) as exc_info:
+        daemon.load_config_from_env({name: raw})
+    assert exc_info.value.code == 2
+
+
+def test_load_config_parses_integers():
+    config = daemon.load_config_from_env({"DEBOUNCE_MS": "0", "BACKUP_RETAIN": "3"})
+    assert (config.debounce_ms, config.backup_retain) == (0, 3)
+
+
+def test_debouncer_coalesces_burst_into_one_call_after_last_trigger():
+    fired = []
+    done = threading.Event()
+
+    def action():
+        fired.append(time.monotonic())
+        done.set()
+
+    debouncer = daemon.Debouncer(100, action)
+    try:
+        for _ in range(5):
+            debouncer.trigger()
+            time.sleep(0.02)
+        last_trigger = time.monotonic()
+        debouncer.trigger()
+
+        assert done.wait(2.0)
+        time.sleep(0.2)
+        assert len(fired) == 1
+        assert fired[0] - last_trigger >= 0.1
+    finally:
+        debouncer.cancel()
+
+
+def test_debouncer_cancel_stops_worker_and_pending_action():
+    fired = []
+    debouncer = daemon.Debouncer(50, lambda: fired.append(True))
+
+    debouncer.trigger()
+    debouncer.cancel()
+
+    assert not debouncer._worker.is_alive()
+    time.sleep(0.1)
+    assert fired == []
+
+
+def test_changed_flag_sync_evaluates_only_dirty_keys(tmp_path):
+    env_sync = make_daemon(tmp_path, {"A": "1", "B": "1"})
+    env_sync._sync_all_flags_to_env()
+    env_sync._client.calls.clear()
+
+    env_sync._client.values["B"] = "2"
+    env_sync._dirty_add("B")
+    env_sync._sync_changed_flags_to_env()
+
+    assert env_sync._client.calls == ["B"]
+    assert env_sync._last_values == {"A": "1", "B": "2"}
+    assert (tmp_path / ".env").read_text(encoding="utf-8") == "A=1\nB=2\n"
+
+
+def test_changed_flag_sync_requeues_keys_when_write_fails(tmp_path, monkeypatch):
+    env_sync = make_daemon(tmp_path, {"A": "1", "B": "1"})
+    env_sync._sync_all_flags_to_env()
+    real_write = daemon.write_env_values
+
+    def disk_full(*_args, **_kwargs):
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    env_sync._client.values["A"] = "2"
+    env_sync._dirty_add("A")
+    monkeypatch.setattr(daemon, "write_env_values", disk_full)
+    with pytest.raises(OSError):
+        env_sync._sync_changed_flags_to_env()
+    assert env_sync._dirty == {"A"}
+
+    monkeypatch.setattr(daemon, "write_env_values", real_write)
+    env_sync._client.values["B"] = "2"
+    env_sync._dirty_add("B")
+    env_sync._sync_changed_flags_to_env()
+
+    assert env_sync._dirty == set()
+    assert (tmp_path / ".env").read_text(encoding="utf-8") == "A=2\nB=2\n"